@@ -3,11 +3,16 @@
 # Compatible with DHT22 and MQ-135 sensors
 
 import network
+import os
+import struct
 import urequests
 import ujson
 import time
 import machine
-from machine import Pin, ADC
+import ntptime
+import uasyncio as asyncio
+from machine import Pin, ADC, Timer
+from array import array
 import dht
 
 # Configuration
@@ -17,17 +22,83 @@ BACKEND_URL = "https://your-backend-domain.com"
 DEVICE_SECRET = "your_device_secret_key"
 DEVICE_ID = "ESP32_CLIMATE_001"
 
+# Debug output (per-reading and success messages; errors are always printed)
+DEBUG = False
+
+# Power Configuration
+DEEP_SLEEP = False  # Deep-sleep between readings instead of staying awake
+STATIC_IP = None  # e.g. ("192.168.1.50", "255.255.255.0", "192.168.1.1", "8.8.8.8") to skip DHCP
+
+# MQTT Configuration (publish over a persistent TLS connection instead of HTTPS)
+MQTT_BROKER = ""  # e.g. "broker.your-backend-domain.com"; empty uses HTTPS
+MQTT_PORT = 8883
+MQTT_CA_CERT = "mqtt_ca.pem"  # CA certificate (on the internal FS) used to verify the broker
+MQTT_INSECURE = False  # Skip broker certificate verification; testing only, exposes DEVICE_SECRET
+MQTT_KEEPALIVE = 120  # Seconds; the broker drops connections idle for longer
+
+# Batching Configuration
+BATCH_SIZE = 10  # Readings per POST
+MAX_WAIT = 600  # Max seconds a reading may wait in the buffer
+MAX_BUFFER = 1440  # Readings kept in flash while offline (one day, ~28 KB)
+BUFFER_PATH = "buf.bin"
+REJECT_PATH = "rejected.bin"  # Readings the backend reported as invalid, kept for inspection
+MAX_REJECTED = 100  # Cap on the reject file (~2 KB)
+
 # Pin Configuration
 DHT_PIN = 4
 MQ135_PIN = 34
 LED_PIN = 2
 
+# MQ-135 background sampling (averaged over a ring of recent ADC samples)
+MQ135_SAMPLE_HZ = 100
+MQ135_SAMPLES = 64
+
+# Request constants (built once instead of on every send)
+_BATCH_URL = BACKEND_URL + "/api/data/submit_batch"
+_HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": "Bearer " + DEVICE_SECRET
+}
+
+_TOPIC = b"climate/" + DEVICE_ID.encode()
+
+# Payload templates (fixed schema, avoids ujson dict traversal on every send)
+# Update latitude/longitude with actual location
+_DATA_TMPL = '{"temperature":%s,"humidity":%s,"co2":%s,"air_quality":"%s","raw_mq135":%d}'
+_READING_TMPL = '{"timestamp":%d,"data":%s}'
+_BATCH_TMPL = '{"deviceId":"%s","location":{"latitude":3.1390,"longitude":101.6869},"submissions":[%s]}'
+
+# Pre-initialize JSON module state before the first real encode
+ujson.dumps(None)
+
+if MQTT_BROKER:
+    import ssl
+    from umqtt.simple import MQTTClient
+
+# Air quality classes indexed by how many CO2 thresholds (400, 1000 ppm) are exceeded
+_AQ = ("Good", "Moderate", "Poor")
+
 # Initialize sensors
 dht_sensor = dht.DHT22(Pin(DHT_PIN))
 mq135_adc = ADC(Pin(MQ135_PIN))
 mq135_adc.atten(ADC.ATTN_11DB)
 led = Pin(LED_PIN, Pin.OUT)
 
+# Sample the MQ-135 from a timer so read_sensors never blocks on the ADC
+mq135_buf = array("H", [0] * MQ135_SAMPLES)
+mq135_idx = 0
+mq135_count = 0
+
+def sample_mq135(_timer):
+    global mq135_idx, mq135_count
+    mq135_buf[mq135_idx] = mq135_adc.read()
+    mq135_idx = (mq135_idx + 1) % MQ135_SAMPLES
+    if mq135_count < MQ135_SAMPLES:
+        mq135_count += 1
+
+mq135_timer = Timer(0)
+mq135_timer.init(freq=MQ135_SAMPLE_HZ, mode=Timer.PERIODIC, callback=sample_mq135)
+
 # WiFi connection
 def connect_wifi():
     wlan = network.WLAN(network.STA_IF)
@@ -35,6 +106,8 @@ def connect_wifi():
     
     if not wlan.isconnected():
         print('Connecting to WiFi...')
+        if STATIC_IP:
+            wlan.ifconfig(STATIC_IP)
         wlan.connect(WIFI_SSID, WIFI_PASSWORD)
         
         timeout = 0
@@ -50,21 +123,109 @@ def connect_wifi():
             return False
     return True
 
+# Ports built with a 2000 epoch need an offset for Unix timestamps
+_EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+
+# Current Unix time in seconds
+def unix_time():
+    return int(time.time()) + _EPOCH_OFFSET
+
+# The RTC starts near the epoch after power-on; the backend rejects timestamps
+# before Sept 2020, so readings are only taken once the clock has been set
+def clock_valid():
+    return unix_time() >= 1600000000
+
+# Set the RTC from NTP (needs Wi-Fi); returns whether the clock is now valid
+def sync_clock():
+    try:
+        ntptime.settime()
+    except Exception as e:
+        print("NTP sync failed:", e)
+    return clock_valid()
+
+# MQTT connection (kept open between publishes)
+mqtt_client = None
+mqtt_last = 0  # time.time() of the last exchange with the broker
+
+def connect_mqtt():
+    global mqtt_client, mqtt_last
+    try:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        if MQTT_INSECURE:
+            ctx.verify_mode = ssl.CERT_NONE
+        else:
+            # DEVICE_SECRET is sent as the broker password, so authenticate the broker first
+            ctx.verify_mode = ssl.CERT_REQUIRED
+            ctx.load_verify_locations(cafile=MQTT_CA_CERT)
+        client = MQTTClient(
+            DEVICE_ID,
+            MQTT_BROKER,
+            port=MQTT_PORT,
+            user=DEVICE_ID,
+            password=DEVICE_SECRET,
+            keepalive=MQTT_KEEPALIVE,
+            ssl=ctx
+        )
+        client.connect()
+        mqtt_client = client
+        mqtt_last = time.time()
+        print('MQTT connected:', MQTT_BROKER)
+        return True
+    except Exception as e:
+        print("MQTT connection error:", e)
+        mqtt_client = None
+        return False
+
+# Close the MQTT connection, ignoring errors from an already dead socket
+def close_mqtt():
+    global mqtt_client
+    try:
+        mqtt_client.sock.close()
+    except Exception:
+        pass
+    mqtt_client = None
+
+# Publish a payload over MQTT, reconnecting if the connection was lost
+def publish(body):
+    global mqtt_client, mqtt_last
+    # Batches can be up to MAX_WAIT apart, longer than the keepalive, so the
+    # broker will have closed an idle connection; start a fresh one instead
+    if mqtt_client is not None and time.time() - mqtt_last >= MQTT_KEEPALIVE:
+        close_mqtt()
+    if mqtt_client is None and not connect_mqtt():
+        return False
+    try:
+        # QoS 1 blocks until the broker's PUBACK, so success means it was stored
+        mqtt_client.publish(_TOPIC, body, qos=1)
+        mqtt_last = time.time()
+        if DEBUG:
+            print("Data published successfully")
+        return True
+    except Exception as e:
+        print("MQTT publish error:", e)
+        close_mqtt()
+        return False
+
 # Read sensors
 def read_sensors():
     try:
+        # Stamp the reading when it is taken so delayed batches carry correct times
+        ts = unix_time()
+        
         # Read DHT22
         dht_sensor.measure()
         temperature = dht_sensor.temperature()
         humidity = dht_sensor.humidity()
         
         # Read MQ-135 (Air Quality)
-        mq135_raw = mq135_adc.read()
+        # Average of the latest samples (unfilled slots are zero)
+        mq135_raw = sum(mq135_buf) // mq135_count if mq135_count else mq135_adc.read()
         # Convert to ppm (simplified calculation)
         co2_ppm = (mq135_raw / 4095.0) * 1000
-        air_quality = "Good" if co2_ppm < 400 else "Moderate" if co2_ppm < 1000 else "Poor"
+        air_quality = _AQ[(co2_ppm >= 400) + (co2_ppm >= 1000)]
         
         return {
+            "ts": ts,
             "temperature": temperature,
             "humidity": humidity,
             "co2": co2_ppm,
@@ -75,80 +236,321 @@ def read_sensors():
         print("Sensor read error:", e)
         return None
 
-# Send data to backend
-def send_data(sensor_data):
+# Encode sensor data with the fixed payload template
+def encode_data(sensor_data):
+    return _DATA_TMPL % (
+        sensor_data["temperature"],
+        sensor_data["humidity"],
+        sensor_data["co2"],
+        sensor_data["air_quality"],
+        sensor_data["raw_mq135"]
+    )
+
+# Encode buffered (timestamp, sensor_data) readings as one batch payload
+def encode_batch(readings):
+    return _BATCH_TMPL % (
+        DEVICE_ID,
+        ",".join([_READING_TMPL % (ts, encode_data(data)) for ts, data in readings])
+    )
+
+# Send a batch of buffered readings in one request. Returns None when the batch
+# should be retried, otherwise the indices the backend rejected as invalid readings.
+def send_batch(readings):
     try:
-        payload = {
-            "deviceId": DEVICE_ID,
-            "timestamp": time.time(),
-            "location": {
-                "latitude": 3.1390,  # Update with actual location
-                "longitude": 101.6869
-            },
-            "data": sensor_data
-        }
+        body = encode_batch(readings)
         
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {DEVICE_SECRET}"
-        }
+        if MQTT_BROKER:
+            return [] if publish(body) else None
         
         response = urequests.post(
-            f"{BACKEND_URL}/api/data/submit",
-            data=ujson.dumps(payload),
-            headers=headers
+            _BATCH_URL,
+            data=body,
+            headers=_HEADERS
         )
         
-        if response.status_code == 200:
-            print("Data sent successfully")
-            led.on()
-            time.sleep(0.1)
-            led.off()
-            return True
-        else:
-            print(f"Failed to send data: {response.status_code}")
-            return False
+        # Close on every path so the socket and its buffers are released
+        try:
+            status = response.status_code
+            if status == 200:
+                rejected = [r["index"] for r in response.json()["data"]["rejected"]]
+        finally:
+            response.close()
+        
+        # Anything but a 200 (auth, routing, size or server errors) is retried;
+        # only readings listed as rejected in a 200 response are given up on
+        if status != 200:
+            print("Failed to send batch:", status)
+            return None
+        
+        if DEBUG:
+            print("Batch sent successfully:", len(readings))
+        return rejected
             
     except Exception as e:
-        print("Send data error:", e)
+        print("Send batch error:", e)
+        return None
+
+# Send the oldest batch and drop it once the backend has stored it, moving any
+# readings it rejected to the reject file. Returns False when it should be retried.
+def send_oldest(buf):
+    readings = buf.read(BATCH_SIZE)
+    rejected = send_batch(readings)
+    if rejected is None:
         return False
+    if rejected:
+        print("Rejected readings moved to", REJECT_PATH, len(rejected))
+    buf.drop(len(readings), rejected)
+    return True
 
-# Main loop
-def main():
-    print("Starting ESP32 Climate Sensor...")
+# Persistent reading buffer: fixed-width records in a ring file on the internal FS
+# File layout: header (head, count) followed by MAX_BUFFER record slots
+_HDR = "<II"
+_HDR_SIZE = struct.calcsize(_HDR)
+_REC = "<Ifffi"  # timestamp, temperature, humidity, co2, raw_mq135
+_REC_SIZE = struct.calcsize(_REC)  # 20 bytes
+
+class RingBuffer:
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        try:
+            with open(path, "rb") as f:
+                self.head, self.count = struct.unpack(_HDR, f.read(_HDR_SIZE))
+            valid = os.stat(path)[6] == _HDR_SIZE + capacity * _REC_SIZE
+        except (OSError, ValueError):
+            valid = False
+        if not valid or self.head >= capacity or self.count > capacity:
+            self.reset()
     
-    # Connect to WiFi
-    if not connect_wifi():
-        print("Cannot continue without WiFi")
-        return
+    def __len__(self):
+        return self.count
     
-    print("Sensor initialized. Starting data collection...")
+    # Create the file with all slots preallocated so later writes never grow it
+    def reset(self):
+        self.head = 0
+        self.count = 0
+        blank = bytes(_REC_SIZE * 16)
+        with open(self.path, "wb") as f:
+            f.write(struct.pack(_HDR, 0, 0))
+            for _ in range(self.capacity // 16):
+                f.write(blank)
+            f.write(bytes(_REC_SIZE * (self.capacity % 16)))
+    
+    def _write_header(self, f):
+        f.seek(0)
+        f.write(struct.pack(_HDR, self.head, self.count))
     
+    # Append a reading, overwriting the oldest one when the ring is full
+    def append(self, sensor_data):
+        record = struct.pack(
+            _REC,
+            sensor_data["ts"],
+            sensor_data["temperature"],
+            sensor_data["humidity"],
+            sensor_data["co2"],
+            sensor_data["raw_mq135"]
+        )
+        slot = (self.head + self.count) % self.capacity
+        with open(self.path, "r+b") as f:
+            f.seek(_HDR_SIZE + slot * _REC_SIZE)
+            f.write(record)
+            if self.count < self.capacity:
+                self.count += 1
+            else:
+                self.head = (self.head + 1) % self.capacity
+            self._write_header(f)
+    
+    # Return up to n of the oldest readings as (timestamp, sensor_data) tuples
+    def read(self, n):
+        readings = []
+        with open(self.path, "rb") as f:
+            for i in range(min(n, self.count)):
+                f.seek(_HDR_SIZE + ((self.head + i) % self.capacity) * _REC_SIZE)
+                ts, temperature, humidity, co2_ppm, mq135_raw = struct.unpack(_REC, f.read(_REC_SIZE))
+                readings.append((ts, {
+                    "temperature": temperature,
+                    "humidity": humidity,
+                    "co2": co2_ppm,
+                    "air_quality": _AQ[(co2_ppm >= 400) + (co2_ppm >= 1000)],
+                    "raw_mq135": mq135_raw
+                }))
+        return readings
+    
+    # Drop the n oldest readings once the backend has stored them, first copying
+    # the ones at the rejected offsets to the reject file
+    def drop(self, n, rejected=()):
+        n = min(n, self.count)
+        if rejected:
+            self._reject([i for i in rejected if 0 <= i < n])
+        self.head = (self.head + n) % self.capacity
+        self.count -= n
+        with open(self.path, "r+b") as f:
+            self._write_header(f)
+    
+    # Append the records at the given offsets from head to the capped reject file
+    def _reject(self, offsets):
+        try:
+            kept = os.stat(REJECT_PATH)[6] // _REC_SIZE
+        except OSError:
+            kept = 0
+        room = max(MAX_REJECTED - kept, 0)
+        if len(offsets) > room:
+            print("Reject file full, discarding:", len(offsets) - room)
+            offsets = offsets[:room]
+        if not offsets:
+            return
+        with open(self.path, "rb") as src, open(REJECT_PATH, "ab") as dst:
+            for i in offsets:
+                src.seek(_HDR_SIZE + ((self.head + i) % self.capacity) * _REC_SIZE)
+                dst.write(src.read(_REC_SIZE))
+
+# Blink LED to indicate successful data transmission
+async def blink_led():
+    led.on()
+    await asyncio.sleep_ms(100)
+    led.off()
+
+# Sampling task: read sensors every 60 seconds and buffer the readings
+async def sample_task(buf, ready):
     while True:
         try:
+            # Hold off until the clock is set rather than buffer unusable timestamps
+            if not clock_valid() and not sync_clock():
+                print("Clock not set, skipping reading")
+                await asyncio.sleep(60)
+                continue
+            
             # Read sensor data
             sensor_data = read_sensors()
             
             if sensor_data:
-                print(f"Temperature: {sensor_data['temperature']}°C")
-                print(f"Humidity: {sensor_data['humidity']}%")
-                print(f"CO2: {sensor_data['co2']} ppm")
-                print(f"Air Quality: {sensor_data['air_quality']}")
+                if DEBUG:
+                    print("Temperature:", sensor_data["temperature"], "°C")
+                    print("Humidity:", sensor_data["humidity"], "%")
+                    print("CO2:", sensor_data["co2"], "ppm")
+                    print("Air Quality:", sensor_data["air_quality"])
                 
-                # Send to backend
-                send_data(sensor_data)
+                # Buffer reading for the next batch
+                buf.append(sensor_data)
+                if len(buf) >= BATCH_SIZE:
+                    ready.set()
             else:
                 print("Failed to read sensors")
             
             # Wait 60 seconds before next reading
-            time.sleep(60)
+            await asyncio.sleep(60)
             
-        except KeyboardInterrupt:
-            print("Stopping sensor...")
-            break
         except Exception as e:
-            print("Main loop error:", e)
-            time.sleep(10)
+            print("Sample task error:", e)
+            await asyncio.sleep(10)
+
+# Sending task: drain the buffer once a batch is full or the oldest reading is due
+async def send_task(buf, ready):
+    while True:
+        try:
+            try:
+                await asyncio.wait_for(ready.wait(), MAX_WAIT)
+            except asyncio.TimeoutError:
+                pass
+            ready.clear()
+            
+            # Send old and new readings batch by batch until the buffer is empty
+            while len(buf):
+                if not send_oldest(buf):
+                    break
+                
+                # Blinking also yields so sampling and Wi-Fi housekeeping can run between sends
+                await blink_led()
+            
+        except Exception as e:
+            print("Send task error:", e)
+            await asyncio.sleep(10)
+
+async def run():
+    buf = RingBuffer(BUFFER_PATH, MAX_BUFFER)
+    ready = asyncio.Event()
+    if len(buf):
+        # Readings left over from before a reset or outage
+        ready.set()
+    await asyncio.gather(sample_task(buf, ready), send_task(buf, ready))
+
+# Deep-sleep cycle: take one reading, send only when a batch is due, then sleep.
+# Readings persist in the ring file; the last send time persists in RTC memory.
+def sleep_cycle():
+    rtc = machine.RTC()
+    state = {"sent_ts": time.time()}
+    if machine.reset_cause() == machine.DEEPSLEEP_RESET:
+        try:
+            state = ujson.loads(rtc.memory())
+        except ValueError:
+            pass
+    
+    # Always go back to sleep, even if the flash or network fails, so one bad
+    # cycle cannot leave the device awake and draining its battery
+    try:
+        buf = RingBuffer(BUFFER_PATH, MAX_BUFFER)
+        
+        # The RTC keeps time across deep sleep but not across power loss
+        if not clock_valid() and not (connect_wifi() and sync_clock()):
+            print("Clock not set, skipping reading")
+        else:
+            # Let the MQ-135 sample ring fill before reading
+            time.sleep_ms(MQ135_SAMPLES * 1000 // MQ135_SAMPLE_HZ)
+            sensor_data = read_sensors()
+            if sensor_data:
+                buf.append(sensor_data)
+            else:
+                print("Failed to read sensors")
+        
+        # Only bring up Wi-Fi when a batch is full or the oldest reading is due
+        if len(buf) >= BATCH_SIZE or (len(buf) and time.time() - state["sent_ts"] > MAX_WAIT):
+            if connect_wifi():
+                # Correct RTC drift accumulated during deep sleep
+                sync_clock()
+                while len(buf):
+                    if not send_oldest(buf):
+                        break
+                    # Nothing else runs during a sleep cycle, so a blocking blink is fine here
+                    led.on()
+                    time.sleep_ms(100)
+                    led.off()
+                # Only restart the MAX_WAIT clock once everything was sent, so
+                # leftovers from a failed send are retried on the next wake
+                if not len(buf):
+                    state["sent_ts"] = time.time()
+    except Exception as e:
+        print("Sleep cycle error:", e)
+    finally:
+        rtc.memory(ujson.dumps(state))
+        machine.deepsleep(60000)
+
+# Main loop
+def main():
+    print("Starting ESP32 Climate Sensor...")
+    
+    if DEEP_SLEEP:
+        sleep_cycle()
+        return
+    
+    # Connect to WiFi
+    if not connect_wifi():
+        print("Cannot continue without WiFi")
+        return
+    
+    if not sync_clock():
+        print("Clock not set yet, will retry before each reading")
+    
+    if MQTT_BROKER:
+        connect_mqtt()
+    
+    print("Sensor initialized. Starting data collection...")
+    
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Stopping sensor...")
+    finally:
+        asyncio.new_event_loop()
 
 if __name__ == "__main__":
     main()
@@ -5,14 +5,25 @@ Devmatch Climate Data Marketplace
 Compatible with DHT22 and MQ-135 sensors via GPIO
 """
 
+import os
 import time
-import json
-import requests
+import random
+import struct
+import asyncio
+import httpx
+import paho.mqtt.client as mqtt
 import RPi.GPIO as GPIO
 import Adafruit_DHT
 from datetime import datetime
 import logging
 
+try:
+    import orjson
+    dumps = orjson.dumps
+except ImportError:
+    import json
+    dumps = lambda obj: json.dumps(obj, separators=(",", ":")).encode()
+
 # Configuration
 WIFI_SSID = "Your_WiFi_SSID"  # Not used directly, ensure Pi is connected
 WIFI_PASSWORD = "Your_WiFi_Password"  # Not used directly
@@ -20,6 +31,15 @@ BACKEND_URL = "https://your-backend-domain.com"
 DEVICE_SECRET = "your_device_secret_key"
 DEVICE_ID = "RPI_CLIMATE_001"
 
+# MQTT Configuration (publish over a persistent TLS connection instead of HTTPS)
+MQTT_BROKER = ""  # e.g. "broker.your-backend-domain.com"; empty uses HTTPS
+MQTT_PORT = 8883
+MQTT_TOPIC = "climate/" + DEVICE_ID
+MQTT_PUBLISH_TIMEOUT = 30  # Seconds to wait for the broker's PUBACK
+
+# Backend endpoints
+_BATCH_URL = BACKEND_URL + "/api/data/submit_batch"
+
 # Pin Configuration
 DHT_PIN = 4
 MQ135_PIN = 18  # For ADC via MCP3008
@@ -27,6 +47,28 @@ LED_PIN = 18
 
 # Sensor Configuration
 DHT_SENSOR = Adafruit_DHT.DHT22
+DHT_RETRIES = 3  # Read attempts per sample
+DHT_RETRY_DELAY = 2  # Seconds between attempts (DHT22 minimum sampling period)
+
+# Air quality classes indexed by how many CO2 thresholds (400, 1000 ppm) are exceeded
+_AQ = ("Good", "Moderate", "Poor")
+
+# Batching Configuration
+BATCH_SIZE = 10  # Readings per POST
+MAX_WAIT = 600  # Max seconds a reading may wait in the buffer
+MAX_BUFFER = 10080  # Readings kept on disk while offline (one week, ~320 KB)
+MAX_REJECTED = 10080  # Cap on the reject file (~320 KB)
+
+# Buffer location: $CLIMATE_STATE_DIR if set, else /var/lib/climate when running
+# as a system service, else the user's state directory (~/.local/state/climate)
+if os.environ.get("CLIMATE_STATE_DIR"):
+    STATE_DIR = os.environ["CLIMATE_STATE_DIR"]
+elif os.access("/var/lib/climate", os.W_OK) or os.access("/var/lib", os.W_OK):
+    STATE_DIR = "/var/lib/climate"
+else:
+    STATE_DIR = os.path.join(os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"), "climate")
+BUFFER_PATH = os.path.join(STATE_DIR, "buf.bin")
+REJECT_PATH = os.path.join(STATE_DIR, "rejected.bin")  # Readings the backend reported as invalid
 
 # Setup logging
 logging.basicConfig(
@@ -35,9 +77,123 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class RingBuffer:
+    """Fixed-capacity ring of reading records persisted to a file
+    
+    The file holds a (head, count) header followed by `capacity`
+    preallocated 32-byte record slots, so readings survive restarts
+    and network outages without the file ever growing.
+    """
+    
+    HEADER = struct.Struct("<II")
+    RECORD = struct.Struct("<Idddi")  # timestamp, temperature, humidity, co2, raw_mq135 (doubles, so values round-trip exactly)
+    
+    def __init__(self, path, capacity, reject_path, reject_capacity):
+        self.path = path
+        self.capacity = capacity
+        self.reject_path = reject_path
+        self.reject_capacity = reject_capacity
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path, "rb") as f:
+                self.head, self.count = self.HEADER.unpack(f.read(self.HEADER.size))
+            valid = os.path.getsize(path) == self.HEADER.size + capacity * self.RECORD.size
+        except (OSError, struct.error):
+            valid = False
+        if not valid or self.head >= capacity or self.count > capacity:
+            self.reset()
+    
+    def __len__(self):
+        return self.count
+    
+    def reset(self):
+        """Create an empty ring file with all record slots preallocated"""
+        self.head = 0
+        self.count = 0
+        with open(self.path, "wb") as f:
+            f.write(self.HEADER.pack(0, 0))
+            f.write(bytes(self.capacity * self.RECORD.size))
+    
+    def _write_header(self, f):
+        f.seek(0)
+        f.write(self.HEADER.pack(self.head, self.count))
+    
+    def append(self, sensor_data):
+        """Append a reading, overwriting the oldest one when the ring is full"""
+        record = self.RECORD.pack(
+            sensor_data["ts"],
+            sensor_data["temperature"],
+            sensor_data["humidity"],
+            sensor_data["co2"],
+            sensor_data["raw_mq135"]
+        )
+        slot = (self.head + self.count) % self.capacity
+        with open(self.path, "r+b") as f:
+            f.seek(self.HEADER.size + slot * self.RECORD.size)
+            f.write(record)
+            if self.count < self.capacity:
+                self.count += 1
+            else:
+                self.head = (self.head + 1) % self.capacity
+            self._write_header(f)
+    
+    def read(self, n):
+        """Return up to n of the oldest readings in submission format"""
+        readings = []
+        with open(self.path, "rb") as f:
+            for i in range(min(n, self.count)):
+                f.seek(self.HEADER.size + ((self.head + i) % self.capacity) * self.RECORD.size)
+                ts, temperature, humidity, co2_ppm, mq135_raw = self.RECORD.unpack(f.read(self.RECORD.size))
+                readings.append({
+                    "timestamp": ts,
+                    "data": {
+                        "temperature": temperature,
+                        "humidity": humidity,
+                        "co2": co2_ppm,
+                        "air_quality": _AQ[(co2_ppm >= 400) + (co2_ppm >= 1000)],
+                        "raw_mq135": mq135_raw
+                    }
+                })
+        return readings
+    
+    def drop(self, n, rejected=()):
+        """Drop the n oldest readings once the backend has stored them
+        
+        Readings at the `rejected` offsets are first copied to the reject
+        file so invalid data is kept for inspection rather than deleted.
+        """
+        n = min(n, self.count)
+        if rejected:
+            self._reject([i for i in rejected if 0 <= i < n])
+        self.head = (self.head + n) % self.capacity
+        self.count -= n
+        with open(self.path, "r+b") as f:
+            self._write_header(f)
+    
+    def _reject(self, offsets):
+        """Append the records at the given offsets from head to the capped reject file"""
+        try:
+            kept = os.path.getsize(self.reject_path) // self.RECORD.size
+        except OSError:
+            kept = 0
+        room = max(self.reject_capacity - kept, 0)
+        if len(offsets) > room:
+            logger.warning("Reject file full, discarding %s readings", len(offsets) - room)
+            offsets = offsets[:room]
+        if not offsets:
+            return
+        with open(self.path, "rb") as src, open(self.reject_path, "ab") as dst:
+            for i in offsets:
+                src.seek(self.HEADER.size + ((self.head + i) % self.capacity) * self.RECORD.size)
+                dst.write(src.read(self.RECORD.size))
+
 class ClimateSensor:
     def __init__(self):
+        # Open the buffer first so a bad STATE_DIR fails before GPIO or MQTT are set up
+        self._buf = RingBuffer(BUFFER_PATH, MAX_BUFFER, REJECT_PATH, MAX_REJECTED)
         self.setup_gpio()
+        self.setup_client()
+        self.setup_mqtt()
         logger.info("Raspberry Pi Climate Sensor initialized")
     
     def setup_gpio(self):
@@ -46,11 +202,75 @@ class ClimateSensor:
         GPIO.setup(LED_PIN, GPIO.OUT)
         GPIO.output(LED_PIN, GPIO.LOW)
     
+    def setup_client(self):
+        """Create a pooled HTTP/2 client so connections are kept alive"""
+        limits = httpx.Limits(max_connections=4, max_keepalive_connections=4)
+        self.client = httpx.AsyncClient(
+            timeout=30.0,
+            transport=httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=3)
+        )
+        self._headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer " + DEVICE_SECRET
+        }
+    
+    def setup_mqtt(self):
+        """Connect to the MQTT broker in the background when configured"""
+        self.mqtt = None
+        if not MQTT_BROKER:
+            return
+        
+        self.mqtt = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=DEVICE_ID, clean_session=True)
+        self.mqtt.username_pw_set(DEVICE_ID, DEVICE_SECRET)
+        self.mqtt.tls_set()
+        self.mqtt.connect_async(MQTT_BROKER, MQTT_PORT, keepalive=120)
+        self.mqtt.loop_start()
+        logger.info("MQTT publishing to %s:%s", MQTT_BROKER, MQTT_PORT)
+    
+    def reset_mqtt(self):
+        """Replace the MQTT client, discarding its in-flight messages
+        
+        paho resends an unacknowledged QoS 1 message after reconnecting, but
+        its readings also stay in the ring for retry. A new client with a
+        clean session drops the old copy so it is not delivered twice.
+        """
+        self.mqtt.disconnect()
+        self.mqtt.loop_stop()
+        self.setup_mqtt()
+    
+    async def publish(self, payload):
+        """Publish a payload over MQTT and wait for the broker's PUBACK"""
+        if not self.mqtt.is_connected():
+            # paho would queue a QoS 1 message while offline and deliver it later,
+            # duplicating the readings that stay in the ring for retry
+            logger.error("Failed to publish data: MQTT broker not connected")
+            return False
+        
+        info = self.mqtt.publish(MQTT_TOPIC, dumps(payload), qos=1)
+        try:
+            await asyncio.to_thread(info.wait_for_publish, MQTT_PUBLISH_TIMEOUT)
+        except (ValueError, RuntimeError) as e:
+            logger.error("Failed to publish data: %s", e)
+            await asyncio.to_thread(self.reset_mqtt)
+            return False
+        
+        if info.is_published():
+            logger.info("Data published successfully")
+            await self.blink_led()
+            return True
+        else:
+            logger.error("Failed to publish data: no PUBACK within %ss", MQTT_PUBLISH_TIMEOUT)
+            await asyncio.to_thread(self.reset_mqtt)
+            return False
+    
     def read_sensors(self):
         """Read all sensor data"""
         try:
+            # Stamp the reading when it is taken so delayed batches carry correct times
+            ts = int(time.time())
+            
             # Read DHT22
-            humidity, temperature = Adafruit_DHT.read_retry(DHT_SENSOR, DHT_PIN)
+            humidity, temperature = Adafruit_DHT.read(DHT_SENSOR, DHT_PIN)
             
             if humidity is None or temperature is None:
                 logger.error("Failed to read DHT22 sensor")
@@ -58,111 +278,175 @@ class ClimateSensor:
             
             # Read MQ-135 (simplified - would need ADC like MCP3008 for real implementation)
             # For demo purposes, we'll simulate the reading
-            import random
             mq135_raw = random.randint(100, 1000)
             co2_ppm = (mq135_raw / 1024.0) * 1000  # Simplified calculation
             
-            air_quality = "Good" if co2_ppm < 400 else "Moderate" if co2_ppm < 1000 else "Poor"
+            air_quality = _AQ[(co2_ppm >= 400) + (co2_ppm >= 1000)]
             
             return {
-                "temperature": round(temperature, 2),
-                "humidity": round(humidity, 2),
-                "co2": round(co2_ppm, 2),
+                "ts": ts,
+                "temperature": temperature,
+                "humidity": humidity,
+                "co2": co2_ppm,
                 "air_quality": air_quality,
                 "raw_mq135": mq135_raw
             }
             
         except Exception as e:
-            logger.error(f"Sensor read error: {e}")
+            logger.error("Sensor read error: %s", e)
             return None
     
-    def send_data(self, sensor_data):
-        """Send sensor data to backend"""
+    async def send_batch(self, readings):
+        """Send a batch of buffered readings in one request
+        
+        Returns None when the batch should be retried, otherwise the indices
+        the backend rejected as invalid readings.
+        """
         try:
             payload = {
                 "deviceId": DEVICE_ID,
-                "timestamp": int(time.time()),
                 "location": {
                     "latitude": 3.1390,  # Update with actual location
                     "longitude": 101.6869
                 },
-                "data": sensor_data
+                "submissions": readings
             }
             
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {DEVICE_SECRET}"
-            }
+            if self.mqtt:
+                return [] if await self.publish(payload) else None
             
-            response = requests.post(
-                f"{BACKEND_URL}/api/data/submit",
-                json=payload,
-                headers=headers,
-                timeout=30
+            response = await self.client.post(
+                _BATCH_URL,
+                content=dumps(payload),
+                headers=self._headers
             )
             
-            if response.status_code == 200:
-                logger.info("Data sent successfully")
-                self.blink_led()
-                return True
-            else:
-                logger.error(f"Failed to send data: {response.status_code}")
-                logger.error(f"Response: {response.text}")
-                return False
+            # Anything but a 200 (auth, routing, size or server errors) is retried;
+            # only readings listed as rejected in a 200 response are given up on
+            if response.status_code != 200:
+                logger.error("Failed to send batch: %s", response.status_code)
+                logger.error("Response: %s", response.text)
+                return None
+            
+            rejected = [r["index"] for r in response.json()["data"]["rejected"]]
+            logger.info("Batch of %s readings sent successfully", len(readings))
+            await self.blink_led()
+            return rejected
                 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Network error: {e}")
-            return False
+        except httpx.HTTPError as e:
+            logger.error("Network error: %s", e)
+            return None
         except Exception as e:
-            logger.error(f"Send data error: {e}")
-            return False
+            logger.error("Send batch error: %s", e)
+            return None
     
-    def blink_led(self):
+    async def blink_led(self):
         """Blink LED to indicate successful data transmission"""
         GPIO.output(LED_PIN, GPIO.HIGH)
-        time.sleep(0.1)
+        await asyncio.sleep(0.1)
         GPIO.output(LED_PIN, GPIO.LOW)
     
-    def run(self):
-        """Main sensor loop"""
-        logger.info("Starting climate data collection...")
-        
-        try:
-            while True:
-                # Read sensor data
+    async def sample_loop(self, ready):
+        """Read sensors every 60 seconds and buffer the readings"""
+        while True:
+            try:
+                # Read sensor data, retrying a bounded number of times
                 sensor_data = self.read_sensors()
+                for _ in range(DHT_RETRIES - 1):
+                    if sensor_data:
+                        break
+                    await asyncio.sleep(DHT_RETRY_DELAY)
+                    sensor_data = self.read_sensors()
                 
                 if sensor_data:
                     logger.info("=== Sensor Readings ===")
-                    logger.info(f"Temperature: {sensor_data['temperature']}°C")
-                    logger.info(f"Humidity: {sensor_data['humidity']}%")
-                    logger.info(f"CO2: {sensor_data['co2']} ppm")
-                    logger.info(f"Air Quality: {sensor_data['air_quality']}")
-                    
-                    # Send to backend
-                    self.send_data(sensor_data)
+                    logger.info("Temperature: %s°C", sensor_data['temperature'])
+                    logger.info("Humidity: %s%%", sensor_data['humidity'])
+                    logger.info("CO2: %s ppm", sensor_data['co2'])
+                    logger.info("Air Quality: %s", sensor_data['air_quality'])
+                
+                    # Buffer reading for the next batch
+                    self._buf.append(sensor_data)
+                    if len(self._buf) >= BATCH_SIZE:
+                        ready.set()
                 else:
                     logger.warning("Failed to read sensors")
                 
                 # Wait 60 seconds before next reading
-                time.sleep(60)
+                await asyncio.sleep(60)
+                
+            except Exception as e:
+                logger.error("Sample loop error: %s", e)
+                await asyncio.sleep(10)
+    
+    async def send_loop(self, ready):
+        """Send buffered readings once a batch is full or the oldest reading is due"""
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(ready.wait(), MAX_WAIT)
+                except asyncio.TimeoutError:
+                    pass
+                ready.clear()
+                await self.flush()
                 
-        except KeyboardInterrupt:
+            except Exception as e:
+                logger.error("Send loop error: %s", e)
+                await asyncio.sleep(10)
+    
+    async def flush(self):
+        """Send old and new buffered readings batch by batch until empty
+        
+        A batch is dropped once the backend has stored it, with any readings
+        it rejected moved to the reject file; anything else is retried later.
+        """
+        while len(self._buf):
+            readings = self._buf.read(BATCH_SIZE)
+            rejected = await self.send_batch(readings)
+            if rejected is None:
+                break
+            if rejected:
+                logger.warning("Moved %s rejected readings to %s", len(rejected), REJECT_PATH)
+            self._buf.drop(len(readings), rejected)
+    
+    async def run(self):
+        """Main sensor loop"""
+        logger.info("Starting climate data collection...")
+        
+        ready = asyncio.Event()
+        if len(self._buf):
+            # Readings left over from before a restart or outage
+            ready.set()
+        try:
+            await asyncio.gather(self.sample_loop(ready), self.send_loop(ready))
+        except asyncio.CancelledError:
             logger.info("Stopping sensor...")
         except Exception as e:
-            logger.error(f"Main loop error: {e}")
+            logger.error("Main loop error: %s", e)
         finally:
-            self.cleanup()
+            await self.cleanup()
     
-    def cleanup(self):
-        """Clean up GPIO resources"""
+    async def cleanup(self):
+        """Clean up GPIO and network resources"""
+        await self.client.aclose()
+        if self.mqtt:
+            self.mqtt.disconnect()
+            self.mqtt.loop_stop()
         GPIO.cleanup()
         logger.info("GPIO cleanup completed")
 
 def main():
     """Main function"""
-    sensor = ClimateSensor()
-    sensor.run()
+    try:
+        sensor = ClimateSensor()
+    except OSError as e:
+        logger.error("Cannot open the reading buffer in %s: %s", STATE_DIR, e)
+        logger.error("Set CLIMATE_STATE_DIR to a writable directory")
+        raise SystemExit(1)
+    try:
+        asyncio.run(sensor.run())
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     main()
@@ -18,6 +18,9 @@ import { DataAggregationService } from './services/DataAggregationService';
 import { IPFSManager } from './services/IPFSManager';
 import { CronManager } from './services/CronManager';
 import { ROFLAppService } from './services/ROFLAppService';
+import { DeviceRegistry } from './services/DeviceRegistry';
+import { DeviceIngestService } from './services/DeviceIngestService';
+import { MqttIngestService } from './services/MqttIngestService';
 import { authMiddleware } from './middleware/auth';
 import { validateRequest } from './middleware/validation';
 import { sensorRoutes } from './routes/sensors';
@@ -54,6 +57,9 @@ class DClimateROFL {
   private ipfsManager!: IPFSManager;
   private cronManager!: CronManager;
   private roflAppService!: ROFLAppService;
+  private deviceRegistry!: DeviceRegistry;
+  private deviceIngestService!: DeviceIngestService;
+  private mqttIngestService: MqttIngestService | null = null;
 
   constructor() {
     this.app = express();
@@ -112,6 +118,22 @@ class DClimateROFL {
       );
       logger.info('✅ Data Aggregation Service initialized');
       
+      // Initialize device ingest for sensor firmware uploads
+      this.deviceRegistry = new DeviceRegistry();
+      this.deviceIngestService = new DeviceIngestService(
+        this.encryptionManager,
+        this.ipfsManager,
+        this.smartContractService
+      );
+      logger.info('✅ Device Ingest Service initialized');
+      
+      // Subscribe to firmware MQTT uploads when a broker is configured
+      if (process.env.MQTT_INGEST_URL) {
+        this.mqttIngestService = new MqttIngestService(this.deviceRegistry, this.deviceIngestService);
+        this.mqttIngestService.start();
+        logger.info('✅ MQTT Ingest Service started');
+      }
+      
       // Initialize confidential services
       this.sensorIdGenerator = new SensorIdGenerator(this.sapphireClient);
       this.dataValidator = new DataValidator(this.sapphireClient, this.encryptionManager);
@@ -178,6 +200,10 @@ class DClimateROFL {
         logger.debug(`Skipping auth for public endpoint: ${req.path}`);
         return next();
       }
+      // Sensor firmware authenticates with its device secret inside the data router
+      if (req.path === '/data/submit_batch') {
+        return next();
+      }
       // Apply auth middleware for protected endpoints
       return authMiddleware(req, res, next);
     });
@@ -319,7 +345,9 @@ class DClimateROFL {
       this.ipfsManager,
       this.sapphireClient,
       this.smartContractService,
-      this.dataAggregationService
+      this.dataAggregationService,
+      this.deviceRegistry,
+      this.deviceIngestService
     );
     logger.info('Data routes created:', !!dataRouter);
     this.app.use('/api/data', dataRouter);
@@ -410,6 +438,7 @@ class DClimateROFL {
       this.cronManager.stopAll();
       
       // Disconnect from services
+      this.mqttIngestService?.stop();
       await this.sapphireClient.disconnect();
       await this.ipfsManager.disconnect();
       
@@ -1,6 +1,7 @@
 import { Request, Response, NextFunction } from 'express';
 import { ethers } from 'ethers';
 import { createLogger } from '../utils/logger';
+import { DeviceRegistry, DeviceRecord } from '../services/DeviceRegistry';
 
 const logger = createLogger('AuthMiddleware');
 
@@ -16,6 +17,13 @@ export interface AuthenticatedRequest extends Request {
   };
 }
 
+/**
+ * Extended Request interface with device information
+ */
+export interface DeviceAuthenticatedRequest extends Request {
+  device?: DeviceRecord;
+}
+
 /**
  * Authentication middleware for D-Climate ROFL API
  * Validates wallet signatures for API access
@@ -177,6 +185,43 @@ function generateNonce(address: string, timestamp: number): string {
   return crypto.createHash('sha256').update(data).digest('hex').substring(0, 16);
 }
 
+/**
+ * Device authentication middleware for sensor firmware
+ * Validates the device's shared secret sent as a bearer token
+ */
+export const deviceAuthMiddleware = (deviceRegistry: DeviceRegistry) => {
+  return (req: DeviceAuthenticatedRequest, res: Response, next: NextFunction): void => {
+    const authorization = req.headers['authorization'] || '';
+    const deviceId = req.body?.deviceId;
+
+    if (!authorization.startsWith('Bearer ') || typeof deviceId !== 'string') {
+      res.status(401).json({
+        error: 'Authentication required',
+        message: 'Missing device ID or bearer token'
+      });
+      return;
+    }
+
+    const device = deviceRegistry.authenticate(deviceId, authorization.slice('Bearer '.length));
+
+    if (!device) {
+      logger.warn('Invalid device credentials', {
+        ip: req.ip,
+        deviceId
+      });
+
+      res.status(401).json({
+        error: 'Authentication failed',
+        message: 'Invalid device credentials'
+      });
+      return;
+    }
+
+    req.device = device;
+    next();
+  };
+};
+
 /**
  * Middleware to check sensor ownership
  */
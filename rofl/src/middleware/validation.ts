@@ -147,6 +147,59 @@ export const validationSchemas = {
       .required()
   }),
 
+  // Raw sensor reading validation (one entry of a device batch)
+  rawReading: Joi.object({
+    timestamp: Joi.number()
+      .integer()
+      .min(1600000000) // Sept 2020
+      .required(),
+    data: Joi.object({
+      temperature: Joi.number()
+        .min(-50)
+        .max(60)
+        .required(),
+      humidity: Joi.number()
+        .min(0)
+        .max(100)
+        .required(),
+      co2: Joi.number()
+        .min(300)
+        .max(10000)
+        .required(),
+      air_quality: Joi.string()
+        .valid('Good', 'Moderate', 'Poor'),
+      raw_mq135: Joi.number()
+        .integer()
+        .min(0)
+    }).required()
+  }).required(),
+
+  // Device batch envelope validation (entries are validated individually)
+  deviceBatch: Joi.object({
+    deviceId: Joi.string()
+      .pattern(/^[A-Za-z0-9_-]{1,64}$/)
+      .required(),
+    location: Joi.object({
+      latitude: Joi.number()
+        .min(-90)
+        .max(90)
+        .required(),
+      longitude: Joi.number()
+        .min(-180)
+        .max(180)
+        .required()
+    }),
+    submissions: Joi.array()
+      .items(Joi.object().unknown(true))
+      .min(1)
+      .max(50)
+      .required()
+      .messages({
+        'array.min': 'Batch must contain at least 1 submission',
+        'array.max': 'Batch cannot contain more than 50 submissions'
+      })
+  }),
+
   // Wallet address validation
   walletAddress: Joi.string()
     .pattern(/^0x[a-fA-F0-9]{40}$/)
@@ -312,6 +365,12 @@ export const validateDataBatch = (req: Request, res: Response, next: NextFunctio
   }
 };
 
+// Validate device batch envelope in request body
+export const validateDeviceBatch = validateRequest(
+  validationSchemas.deviceBatch,
+  'body'
+);
+
 // Validate time-based queries
 export const validateTimeQuery = (req: Request, res: Response, next: NextFunction): void => {
   try {
@@ -4,11 +4,19 @@ import { EncryptionManager } from '../services/EncryptionManager';
 import { IPFSManager } from '../services/IPFSManager';
 import { SapphireClient } from '../services/SapphireClient';
 import { SmartContractService } from '../services/SmartContractService';
-import { AuthenticatedRequest, requireSensorOwnership } from '../middleware/auth';
+import { DeviceRegistry } from '../services/DeviceRegistry';
+import { DeviceIngestService } from '../services/DeviceIngestService';
+import {
+  AuthenticatedRequest,
+  DeviceAuthenticatedRequest,
+  requireSensorOwnership,
+  deviceAuthMiddleware
+} from '../middleware/auth';
 import { 
   validateClimateData, 
   validateDataSubmission, 
   validateDataBatch,
+  validateDeviceBatch,
   validatePagination,
   validateTimeQuery,
   validateRegionFilter
@@ -30,7 +38,9 @@ export function dataRoutes(
   ipfsManager: IPFSManager,
   sapphireClient: SapphireClient,
   smartContractService: SmartContractService,
-  dataAggregationService: DataAggregationService // Added parameter
+  dataAggregationService: DataAggregationService, // Added parameter
+  deviceRegistry: DeviceRegistry,
+  deviceIngestService: DeviceIngestService
 ): Router {
   const router = Router();
 
@@ -234,6 +244,43 @@ export function dataRoutes(
     }
   );
 
+  /**
+   * POST /api/data/submit_batch
+   * Ingest a batch of raw readings from sensor firmware (device bearer auth).
+   * Invalid readings are listed in `rejected` by index; the rest are stored.
+   */
+  router.post('/submit_batch',
+    deviceAuthMiddleware(deviceRegistry),
+    validateDeviceBatch,
+    async (req: DeviceAuthenticatedRequest, res: Response) => {
+      try {
+        const device = req.device!;
+
+        logger.info(`Processing ${req.body.submissions.length} readings from device: ${device.deviceId}`);
+
+        const result = await deviceIngestService.ingestBatch(device, req.body);
+
+        res.json({
+          success: true,
+          data: {
+            deviceId: device.deviceId,
+            sensorId: device.sensorId,
+            ...result
+          },
+          message: `Device batch ingested: ${result.accepted}/${req.body.submissions.length} readings accepted`
+        });
+
+      } catch (error) {
+        logger.error('Device batch ingest failed:', error);
+        res.status(500).json({
+          success: false,
+          error: 'Device batch ingest failed',
+          message: error instanceof Error ? error.message : 'Unknown error'
+        });
+      }
+    }
+  );
+
   /**
    * GET /api/data/:sensorId
    * Get climate data for a specific sensor (owner only for decrypted data)
@@ -0,0 +1,156 @@
+import { createLogger } from '../utils/logger';
+import { EncryptionManager } from './EncryptionManager';
+import { IPFSManager } from './IPFSManager';
+import { SmartContractService } from './SmartContractService';
+import { DeviceRecord } from './DeviceRegistry';
+import { validationSchemas } from '../middleware/validation';
+
+const logger = createLogger('DeviceIngestService');
+
+/**
+ * Raw reading batch as sent by the sensor firmware
+ */
+export interface DeviceBatch {
+  deviceId: string;
+  location?: {
+    latitude: number;
+    longitude: number;
+  };
+  submissions: any[];
+}
+
+/**
+ * Outcome of ingesting one device batch
+ */
+export interface DeviceIngestResult {
+  accepted: number;
+  rejected: Array<{ index: number; errors: string[] }>;
+  duplicate: boolean;
+  ipfsCid?: string;
+  transactionHash?: string;
+  blockNumber?: number;
+}
+
+/**
+ * Device Ingest Service for D-Climate
+ * Validates raw firmware readings one by one and stores the valid ones as a
+ * single encrypted record per batch, so one bad reading never costs the rest
+ */
+export class DeviceIngestService {
+  private encryptionManager: EncryptionManager;
+  private ipfsManager: IPFSManager;
+  private smartContractService: SmartContractService;
+  private ingestedBatches: Map<string, DeviceIngestResult> = new Map(); // recordHash -> result
+
+  private readonly MAX_FUTURE_DRIFT = 300; // seconds
+  private readonly MAX_TRACKED_BATCHES = 10000;
+
+  constructor(
+    encryptionManager: EncryptionManager,
+    ipfsManager: IPFSManager,
+    smartContractService: SmartContractService
+  ) {
+    this.encryptionManager = encryptionManager;
+    this.ipfsManager = ipfsManager;
+    this.smartContractService = smartContractService;
+  }
+
+  /**
+   * Validate a single raw reading, returning its errors (empty if valid)
+   */
+  public validateReading(reading: any): string[] {
+    const { error } = validationSchemas.rawReading.validate(reading, { abortEarly: false });
+    if (error) {
+      return error.details.map(detail => detail.message);
+    }
+
+    if (reading.timestamp > Math.floor(Date.now() / 1000) + this.MAX_FUTURE_DRIFT) {
+      return ['Future timestamps are not allowed'];
+    }
+
+    return [];
+  }
+
+  /**
+   * Ingest a device batch: reject invalid readings individually, then encrypt,
+   * upload and register the valid ones. Storage and chain errors are thrown so
+   * the caller can ask the device to retry the whole batch.
+   */
+  public async ingestBatch(device: DeviceRecord, batch: DeviceBatch): Promise<DeviceIngestResult> {
+    const readings: any[] = [];
+    const rejected: Array<{ index: number; errors: string[] }> = [];
+
+    batch.submissions.forEach((reading, index) => {
+      const errors = this.validateReading(reading);
+      if (errors.length > 0) {
+        rejected.push({ index, errors });
+      } else {
+        readings.push({ timestamp: reading.timestamp, data: reading.data });
+      }
+    });
+
+    if (rejected.length > 0) {
+      logger.warn(`Rejected ${rejected.length}/${batch.submissions.length} readings from ${device.deviceId}`, {
+        rejected
+      });
+    }
+
+    if (readings.length === 0) {
+      return { accepted: 0, rejected, duplicate: false };
+    }
+
+    const record = {
+      sensorId: device.sensorId,
+      deviceId: device.deviceId,
+      location: batch.location,
+      readings
+    };
+    const recordHash = this.encryptionManager.generateDataHash(record);
+
+    // A retried batch whose response was lost must not be registered twice
+    const previous = this.ingestedBatches.get(recordHash);
+    if (previous) {
+      logger.info(`Duplicate batch from ${device.deviceId} already stored: ${previous.ipfsCid}`);
+      return { ...previous, rejected, duplicate: true };
+    }
+
+    const encryptedData = await this.encryptionManager.encryptClimateData(record, device.sensorId);
+
+    const ipfsResult = await this.ipfsManager.uploadEncryptedData(
+      encryptedData.encryptedData,
+      {
+        sensorId: device.sensorId,
+        timestamp: readings[readings.length - 1].timestamp,
+        encryptedKey: encryptedData.encryptedKey,
+        nonce: encryptedData.nonce,
+        tag: encryptedData.tag,
+        algorithm: encryptedData.metadata.algorithm
+      }
+    );
+
+    const txResult = await this.smartContractService.submitDataBatch(
+      device.sensorId,
+      ipfsResult.cid,
+      encryptedData.encryptedKey,
+      recordHash
+    );
+
+    const result: DeviceIngestResult = {
+      accepted: readings.length,
+      rejected,
+      duplicate: false,
+      ipfsCid: ipfsResult.cid,
+      transactionHash: txResult.transactionHash,
+      blockNumber: txResult.blockNumber
+    };
+
+    if (this.ingestedBatches.size >= this.MAX_TRACKED_BATCHES) {
+      // Maps iterate in insertion order, so this forgets the oldest batch
+      this.ingestedBatches.delete(this.ingestedBatches.keys().next().value as string);
+    }
+    this.ingestedBatches.set(recordHash, result);
+
+    logger.info(`✅ Stored ${readings.length} readings from ${device.deviceId}: ${ipfsResult.cid} (tx: ${txResult.transactionHash})`);
+    return result;
+  }
+}
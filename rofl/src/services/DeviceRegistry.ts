@@ -0,0 +1,74 @@
+import crypto from 'crypto';
+import { createLogger } from '../utils/logger';
+
+const logger = createLogger('DeviceRegistry');
+
+/**
+ * Registered sensor device
+ */
+export interface DeviceRecord {
+  deviceId: string;
+  sensorId: string;
+}
+
+/**
+ * Device Registry for D-Climate firmware
+ * Maps firmware device IDs to their shared secret and minted sensor ID.
+ * Loaded from the DEVICE_REGISTRY environment variable, a JSON object of
+ * the form { "<deviceId>": { "secret": "...", "sensorId": "..." } }
+ */
+export class DeviceRegistry {
+  private devices: Map<string, DeviceRecord & { secretHash: Buffer }> = new Map();
+
+  constructor(registryJson: string = process.env.DEVICE_REGISTRY || '{}') {
+    try {
+      const entries = JSON.parse(registryJson);
+
+      for (const [deviceId, entry] of Object.entries<any>(entries)) {
+        if (!entry || typeof entry.secret !== 'string' || typeof entry.sensorId !== 'string') {
+          logger.warn(`Skipping device ${deviceId}: secret and sensorId are required`);
+          continue;
+        }
+
+        this.devices.set(deviceId, {
+          deviceId,
+          sensorId: entry.sensorId,
+          secretHash: this.hashSecret(entry.secret)
+        });
+      }
+
+      logger.info(`✅ Loaded ${this.devices.size} registered devices`);
+    } catch (error) {
+      logger.error('❌ Failed to parse DEVICE_REGISTRY:', error);
+    }
+  }
+
+  /**
+   * Get a registered device by ID
+   */
+  public get(deviceId: string): DeviceRecord | null {
+    const device = this.devices.get(deviceId);
+    return device ? { deviceId: device.deviceId, sensorId: device.sensorId } : null;
+  }
+
+  /**
+   * Authenticate a device by ID and shared secret
+   */
+  public authenticate(deviceId: string, secret: string): DeviceRecord | null {
+    const device = this.devices.get(deviceId);
+    if (!device) {
+      return null;
+    }
+
+    // Compare fixed-length digests so the check runs in constant time
+    if (!crypto.timingSafeEqual(device.secretHash, this.hashSecret(secret))) {
+      return null;
+    }
+
+    return { deviceId: device.deviceId, sensorId: device.sensorId };
+  }
+
+  private hashSecret(secret: string): Buffer {
+    return crypto.createHash('sha256').update(secret, 'utf8').digest();
+  }
+}
@@ -0,0 +1,304 @@
+import fs from 'fs';
+import net from 'net';
+import tls from 'tls';
+import { createLogger } from '../utils/logger';
+import { DeviceRegistry } from './DeviceRegistry';
+import { DeviceIngestService } from './DeviceIngestService';
+import { validationSchemas } from '../middleware/validation';
+
+const logger = createLogger('MqttIngestService');
+
+// MQTT 3.1.1 control packet types
+const CONNECT = 1;
+const CONNACK = 2;
+const PUBLISH = 3;
+const PUBACK = 4;
+const SUBSCRIBE = 8;
+const SUBACK = 9;
+const PINGREQ = 12;
+
+/**
+ * MQTT Ingest Service for D-Climate
+ * Subscribes to the firmware's climate/<deviceId> topics and feeds each batch
+ * through DeviceIngestService. Implements the small MQTT 3.1.1 client subset
+ * it needs over node's net/tls. Uses a persistent session with QoS 1 and only
+ * acknowledges a batch once it is stored, so the broker keeps undelivered
+ * batches while the backend is down and redelivers them after a failure.
+ *
+ * Configured with MQTT_INGEST_URL (mqtts://host:8883), MQTT_INGEST_USERNAME,
+ * MQTT_INGEST_PASSWORD, MQTT_INGEST_CA (CA file path) and MQTT_INGEST_TOPIC.
+ * The broker must restrict each device to publishing on its own topic.
+ */
+export class MqttIngestService {
+  private deviceRegistry: DeviceRegistry;
+  private deviceIngestService: DeviceIngestService;
+  private url: URL;
+  private topic: string;
+  private socket: net.Socket | null = null;
+  private buffer: Buffer = Buffer.alloc(0);
+  private queue: Promise<void> = Promise.resolve();
+  private pingTimer: NodeJS.Timeout | null = null;
+  private reconnectTimer: NodeJS.Timeout | null = null;
+  private stopped = false;
+
+  private readonly CLIENT_ID = 'dclimate-rofl-ingest';
+  private readonly KEEPALIVE = 60; // seconds
+  private readonly RECONNECT_DELAY = 5000; // ms
+
+  constructor(
+    deviceRegistry: DeviceRegistry,
+    deviceIngestService: DeviceIngestService,
+    url: string = process.env.MQTT_INGEST_URL || ''
+  ) {
+    this.deviceRegistry = deviceRegistry;
+    this.deviceIngestService = deviceIngestService;
+    this.url = new URL(url);
+    this.topic = process.env.MQTT_INGEST_TOPIC || 'climate/+';
+  }
+
+  /**
+   * Connect to the broker and keep reconnecting until stopped
+   */
+  public start(): void {
+    this.stopped = false;
+    this.connect();
+  }
+
+  /**
+   * Close the broker connection
+   */
+  public stop(): void {
+    this.stopped = true;
+    if (this.reconnectTimer) {
+      clearTimeout(this.reconnectTimer);
+      this.reconnectTimer = null;
+    }
+    this.socket?.end();
+  }
+
+  private connect(): void {
+    const secure = this.url.protocol === 'mqtts:';
+    const port = parseInt(this.url.port || (secure ? '8883' : '1883'));
+    const host = this.url.hostname;
+
+    logger.info(`📡 Connecting to MQTT broker ${host}:${port}`);
+
+    const socket = secure
+      ? tls.connect({
+          host,
+          port,
+          servername: host,
+          ca: process.env.MQTT_INGEST_CA ? fs.readFileSync(process.env.MQTT_INGEST_CA) : undefined
+        })
+      : net.connect({ host, port });
+
+    this.socket = socket;
+    this.buffer = Buffer.alloc(0);
+
+    socket.once(secure ? 'secureConnect' : 'connect', () => this.sendConnect());
+    socket.on('data', chunk => this.onData(socket, chunk));
+    socket.on('error', error => logger.error('MQTT connection error:', error));
+    socket.on('close', () => {
+      if (this.socket === socket) {
+        this.socket = null;
+      }
+      if (this.pingTimer) {
+        clearInterval(this.pingTimer);
+        this.pingTimer = null;
+      }
+      if (!this.stopped && !this.reconnectTimer) {
+        logger.warn(`MQTT connection closed, reconnecting in ${this.RECONNECT_DELAY / 1000}s`);
+        this.reconnectTimer = setTimeout(() => {
+          this.reconnectTimer = null;
+          this.connect();
+        }, this.RECONNECT_DELAY);
+      }
+    });
+  }
+
+  private sendConnect(): void {
+    const username = process.env.MQTT_INGEST_USERNAME;
+    const password = process.env.MQTT_INGEST_PASSWORD;
+
+    // Clean session off: the broker keeps our subscription and queued QoS 1 messages
+    let flags = 0;
+    const payload = [this.encodeString(this.CLIENT_ID)];
+    if (username) {
+      flags |= 0x80;
+      payload.push(this.encodeString(username));
+    }
+    if (password) {
+      flags |= 0x40;
+      payload.push(this.encodeString(password));
+    }
+
+    const keepalive = Buffer.alloc(2);
+    keepalive.writeUInt16BE(this.KEEPALIVE);
+
+    this.send(CONNECT << 4, Buffer.concat([
+      this.encodeString('MQTT'),
+      Buffer.from([4, flags]),
+      keepalive,
+      ...payload
+    ]));
+  }
+
+  /**
+   * Split the byte stream into control packets
+   */
+  private onData(socket: net.Socket, chunk: Buffer): void {
+    this.buffer = Buffer.concat([this.buffer, chunk]);
+
+    while (this.buffer.length >= 2) {
+      // Remaining length is a base-128 varint of up to 4 bytes
+      let length = 0;
+      let multiplier = 1;
+      let offset = 1;
+      let complete = false;
+      while (offset < this.buffer.length && offset <= 4) {
+        const byte = this.buffer[offset++];
+        length += (byte & 0x7f) * multiplier;
+        multiplier *= 128;
+        if ((byte & 0x80) === 0) {
+          complete = true;
+          break;
+        }
+      }
+
+      if (!complete) {
+        if (offset > 4) {
+          logger.error('Malformed MQTT packet length, dropping connection');
+          socket.destroy();
+        }
+        return;
+      }
+      if (this.buffer.length < offset + length) {
+        return;
+      }
+
+      const header = this.buffer[0];
+      const body = this.buffer.subarray(offset, offset + length);
+      this.buffer = this.buffer.subarray(offset + length);
+      this.handlePacket(socket, header >> 4, header & 0x0f, body);
+    }
+  }
+
+  private handlePacket(socket: net.Socket, type: number, flags: number, body: Buffer): void {
+    switch (type) {
+      case CONNACK:
+        if (body[1] !== 0) {
+          logger.error(`MQTT broker refused connection (code ${body[1]})`);
+          socket.destroy();
+          return;
+        }
+        logger.info(`✅ MQTT connected, subscribing to ${this.topic}`);
+        this.send(SUBSCRIBE << 4 | 0x02, Buffer.concat([
+          Buffer.from([0, 1]), // packet identifier
+          this.encodeString(this.topic),
+          Buffer.from([1]) // max QoS 1
+        ]));
+        this.pingTimer = setInterval(() => this.send(PINGREQ << 4, Buffer.alloc(0)), this.KEEPALIVE * 1000 / 2);
+        break;
+
+      case SUBACK:
+        if (body[2] === 0x80) {
+          logger.error(`MQTT broker refused subscription to ${this.topic}`);
+        }
+        break;
+
+      case PUBLISH:
+        this.handlePublish(socket, flags, body);
+        break;
+    }
+  }
+
+  private handlePublish(socket: net.Socket, flags: number, body: Buffer): void {
+    const qos = (flags >> 1) & 0x03;
+    const topicLength = body.readUInt16BE(0);
+    const topic = body.toString('utf8', 2, 2 + topicLength);
+    let offset = 2 + topicLength;
+    let packetId: Buffer | null = null;
+    if (qos > 0) {
+      packetId = body.subarray(offset, offset + 2);
+      offset += 2;
+    }
+    const payload = body.subarray(offset);
+
+    // Ingest one batch at a time and acknowledge in order
+    this.queue = this.queue
+      .then(async () => {
+        if (socket !== this.socket) {
+          return; // Connection was dropped; the broker will redeliver
+        }
+        await this.ingest(topic, payload);
+        if (packetId && socket === this.socket) {
+          this.send(PUBACK << 4, packetId);
+        }
+      })
+      .catch(error => {
+        // Leave the batch unacknowledged and reconnect so the broker redelivers it
+        logger.error(`MQTT batch ingest failed on ${topic}, reconnecting:`, error);
+        socket.destroy();
+      });
+  }
+
+  /**
+   * Store one published batch. Malformed payloads and unknown devices are
+   * logged and acknowledged, since redelivering them cannot succeed.
+   */
+  private async ingest(topic: string, payload: Buffer): Promise<void> {
+    const deviceId = topic.split('/').pop() || '';
+
+    let batch: any;
+    try {
+      batch = JSON.parse(payload.toString('utf8'));
+    } catch (error) {
+      logger.warn(`Discarding non-JSON MQTT payload on ${topic}`);
+      return;
+    }
+
+    const { error, value } = validationSchemas.deviceBatch.validate(batch, { stripUnknown: true });
+    if (error || value.deviceId !== deviceId) {
+      logger.warn(`Discarding invalid MQTT batch on ${topic}`, {
+        error: error ? error.message : 'deviceId does not match topic'
+      });
+      return;
+    }
+
+    const device = this.deviceRegistry.get(deviceId);
+    if (!device) {
+      logger.warn(`Discarding MQTT batch from unregistered device: ${deviceId}`);
+      return;
+    }
+
+    const result = await this.deviceIngestService.ingestBatch(device, value);
+    logger.info(`MQTT batch from ${deviceId}: ${result.accepted}/${value.submissions.length} readings accepted`);
+  }
+
+  private send(header: number, body: Buffer): void {
+    if (!this.socket) {
+      return;
+    }
+
+    // Encode the remaining length as a base-128 varint
+    const length: number[] = [];
+    let remaining = body.length;
+    do {
+      let byte = remaining % 128;
+      remaining = Math.floor(remaining / 128);
+      if (remaining > 0) {
+        byte |= 0x80;
+      }
+      length.push(byte);
+    } while (remaining > 0);
+
+    this.socket.write(Buffer.concat([Buffer.from([header, ...length]), body]));
+  }
+
+  private encodeString(value: string): Buffer {
+    const data = Buffer.from(value, 'utf8');
+    const length = Buffer.alloc(2);
+    length.writeUInt16BE(data.length);
+    return Buffer.concat([length, data]);
+  }
+}